@@ -1,19 +1,50 @@
 # Install required packages first:
 # pip install TTS soundfile numpy redis pymongo
 
-from TTS.api import TTS
+import asyncio
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from cachetools import TTLCache, cached
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi_mcp import FastApiMCP
-from meditation_utils import generate_meditation_audio
+from meditation_utils import generate_meditation_audio, prepare_meditation_inputs, preload_emotion_embeddings, stream_meditation_audio
 from user_utils import get_user_voice_path
-from background import generate_background_music, generate_brainwave, combine_audio
-from cache_manager import cache_manager
-
-# 1. Load the pre-trained multi-speaker TTS model
-MODEL_NAME = "tts_models/multilingual/multi-dataset/your_tts"
-tts_model = TTS(model_name=MODEL_NAME, progress_bar=False, gpu=True)
-
-app = FastAPI()
+from background import MUSIC_MAX_BATCH, generate_background_music, generate_brainwave, combine_audio, warmup_music_models
+from cache_manager import get_cache_manager
+from embedding_pool import speaker_embedding_pool
+from schemas import BackgroundOptions
+from speaker_utils import compute_speaker_embedding
+from dependencies import get_tts_runner, get_tts_model
+
+# Dedicated pool so brain waves and mixing run alongside TTS
+audio_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="audio")
+# Music requests block their thread until MusicGen finishes, so they get their own pool, sized so
+# a full MusicGen batch can queue up without holding brain wave renders and mixes behind it
+music_executor = ThreadPoolExecutor(max_workers=MUSIC_MAX_BATCH, thread_name_prefix="music")
+
+# Short-lived cache of /cache_status responses for clients that poll it
+cache_status_responses = TTLCache(maxsize=2048, ttl=5)
+
+# Backend info only changes on failover or config reload, so share it for 30 s
+cache_info_cache = TTLCache(maxsize=1, ttl=30)
+
+@cached(cache_info_cache)
+def get_cache_info():
+    return get_cache_manager().get_cache_info()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pay model warmup and embedding loads once at startup, not on the first request
+    preload_emotion_embeddings()
+    await asyncio.to_thread(get_cache_manager)
+    # Load the pre-trained multi-speaker TTS model (per worker, after fork)
+    await get_tts_runner().warmup()
+    await asyncio.to_thread(warmup_music_models)
+    yield
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 mcp = FastApiMCP(
     app,
     name="mood_management_mc",
@@ -34,6 +65,59 @@ mcp = FastApiMCP(
 )
 mcp.mount()
 
+async def gather_audio_parts(meditation_audio, background_music_args=None, brain_waves_args=None):
+    """Run TTS, background music and brain wave generation concurrently.
+    Returns (voice_audio, background_music, brain_waves) as (samples, sample_rate) tuples, with None for skipped parts."""
+    loop = asyncio.get_running_loop()
+
+    async def skipped():
+        return None
+
+    background_music = skipped()
+    if background_music_args is not None:
+        background_music = loop.run_in_executor(music_executor, generate_background_music, *background_music_args)
+    brain_waves = skipped()
+    if brain_waves_args is not None:
+        brain_waves = loop.run_in_executor(audio_executor, generate_brainwave, *brain_waves_args)
+
+    return await asyncio.gather(meditation_audio, background_music, brain_waves)
+
+async def generate_task_audio(user_id: str, task: str, selected_emotion, selected_tone, min_length: int, background_options: BackgroundOptions, brain_waves_type=None, volume_magnitude=None):
+    """Shared pipeline behind the generate_*_meditation_audio endpoints.
+    brain_waves_type / volume_magnitude override background_options when a task fixes them."""
+    # Resolve text and embeddings first (blocking LLM/Mongo/cache reads, off the event loop), so a
+    # missing speaker embedding fails with a 404 before any music or brain wave work is started
+    text, speaker_embedding, emotion_embedding = await asyncio.to_thread(prepare_meditation_inputs, user_id, task, selected_emotion, selected_tone, min_length)
+
+    # Generate the emotional, speaker-cloned audio
+    meditation_audio = generate_meditation_audio(get_tts_runner(), text, speaker_embedding, emotion_embedding)
+
+    # Generate background music and brain waves alongside the voice
+    background_music_args = None
+    brain_waves_args = None
+    if background_options.should_generate_background_music:
+        background_music_args = (user_id, task, background_options.music_style)
+    if background_options.should_generate_brain_waves:
+        brain_waves_type = brain_waves_type or background_options.brain_waves_type
+        volume_magnitude = volume_magnitude or background_options.volume_magnitude or "low"
+        brain_waves_args = (user_id, brain_waves_type, volume_magnitude)
+
+    voice_audio, background_music, brain_waves = await gather_audio_parts(meditation_audio, background_music_args, brain_waves_args)
+
+    # Combine the emotional, speaker-cloned audio with the background music and brain waves
+    # (resampling, mixing and the file write run in the pool to keep the event loop free)
+    loop = asyncio.get_running_loop()
+    combined_audio_path = await loop.run_in_executor(audio_executor, combine_audio, user_id, voice_audio, background_music, brain_waves)
+
+    return {"status": "success", "output_audio_path": combined_audio_path}
+
+def compute_and_cache_speaker_embedding(user_id: str) -> bool:
+    user_voice_path = get_user_voice_path(user_id)
+    speaker_embedding = compute_speaker_embedding(get_tts_model(), user_voice_path)
+    # Embeddings only carry direction, so fp16 halves the cached payload without audible drift
+    speaker_embedding = torch.as_tensor(speaker_embedding).to(torch.float16).cpu().numpy()
+    return get_cache_manager().set_speaker_embedding(user_id, speaker_embedding)
+
 # CACHE MANAGEMENT ENDPOINTS
 @app.post("/cache_user_voice", 
         operation_id="cache_user_voice", 
@@ -48,14 +132,14 @@ mcp.mount()
 async def cache_user_voice(user_id: str):
     """Generate and cache speaker embedding for a user."""
     try:
-        user_voice_path = get_user_voice_path(user_id)
-        speaker_embedding = tts_model.get_speaker_embedding(user_voice_path)
-        
-        success = cache_manager.set_speaker_embedding(user_id, speaker_embedding)
+        # Mongo lookup, encoder inference and the backend write all block, so run them off the event loop
+        success = await asyncio.to_thread(compute_and_cache_speaker_embedding, user_id)
+        speaker_embedding_pool.evict(user_id)
+        cache_status_responses.pop(user_id, None)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to cache speaker embedding")
         
-        cache_info = cache_manager.get_cache_info()
+        cache_info = get_cache_info()
         return {
             "status": "success", 
             "message": f"Speaker embedding cached for user {user_id}",
@@ -76,15 +160,21 @@ async def cache_user_voice(user_id: str):
         response_description="a dictionary with properties `user_id`, `cached`, `message`, and cached information if successful, or an error message if not")
 async def get_cache_status(user_id: str):
     """Check cache status for a user with system info."""
-    exists = cache_manager.exists_speaker_embedding(user_id)
-    cache_info = cache_manager.get_cache_info()
+    response = cache_status_responses.get(user_id)
+    if response is not None:
+        return response
+
+    exists = await asyncio.to_thread(get_cache_manager().exists_speaker_embedding, user_id)
+    cache_info = get_cache_info()
     
-    return {
+    response = {
         "user_id": user_id,
         "cached": exists,
         "message": "Speaker embedding found" if exists else "Speaker embedding not found. Call /cache_user_voice first.",
         **cache_info
     }
+    cache_status_responses[user_id] = response
+    return response
 
 @app.delete("/clear_user_cache/{user_id}",
         operation_id="clear_user_cache",
@@ -98,7 +188,9 @@ async def get_cache_status(user_id: str):
         response_description="a dictionary with properties `status`, `message` if successful, or an error message if not")
 async def clear_user_cache(user_id: str):
     """Clear cached speaker embedding for a user."""
-    deleted = cache_manager.delete_speaker_embedding(user_id)
+    deleted = await asyncio.to_thread(get_cache_manager().delete_speaker_embedding, user_id)
+    speaker_embedding_pool.evict(user_id)
+    cache_status_responses.pop(user_id, None)
     return {
         "status": "success" if deleted else "not_found",
         "message": f"Speaker embedding {'cleared' if deleted else 'not found'} for user {user_id}"
@@ -116,7 +208,8 @@ async def clear_user_cache(user_id: str):
         response_description="a dictionary with properties `status`, `message` if successful, or an error message if not")
 async def cleanup_expired_cache():
     """Manually cleanup expired cache entries (MongoDB only)."""
-    cleaned = cache_manager.cleanup_expired()
+    cleaned = await asyncio.to_thread(get_cache_manager().cleanup_expired)
+    cache_info_cache.clear()
     return {
         "status": "success",
         "cleaned_entries": cleaned,
@@ -133,7 +226,7 @@ async def cleanup_expired_cache():
             selected_emotion: str (user-selected emotion for release)
             selected_tone: str (user-selected tone for message)
             min_length: int (minimum length of the audio in minutes)
-            background_options: dict (options for background music and brain waves - should have 5 keys. Example:
+            background_options: BackgroundOptions (options for background music and brain waves - all 5 keys are optional. Example:
                 {
                     "should_generate_background_music": True,
                     "music_style": "classical",
@@ -146,31 +239,9 @@ async def cleanup_expired_cache():
             a dictionary with properties `status`, `output_audio_path`
         ''',
         response_description="a dictionary with properties `status`, `output_audio_path` if successful, or an error message if not")
-async def generate_release_meditation_audio(user_id: str, selected_emotion: str, selected_tone: str, min_length: int, background_options: dict):
+async def generate_release_meditation_audio(user_id: str, selected_emotion: str, selected_tone: str, min_length: int, background_options: BackgroundOptions):
     """Generate a release meditation audio."""
-    # Generate the emotional, speaker-cloned audio
-    output_path = generate_meditation_audio(user_id, tts_model, "release", selected_emotion, selected_tone, min_length, background_options)
-
-    background_music_path = None
-    brain_waves_path = None
-    # 5. Generate background music
-    should_generate_background_music = background_options["should_generate_background_music"]
-    music_style = background_options["music_style"]
-    
-    should_generate_brain_waves = background_options["should_generate_brain_waves"]
-    brain_waves_type = background_options["brain_waves_type"]
-    volume_magnitude = background_options["volume_magnitude"]
-
-    if should_generate_background_music:
-        background_music_path = generate_background_music(user_id, "release", music_style)
-
-    if should_generate_brain_waves:
-        brain_waves_path = generate_brainwave(user_id, brain_waves_type, volume_magnitude)
-
-    # 6. Combine the emotional, speaker-cloned audio with the background music and brain waves
-    combined_audio_path = combine_audio(output_path, background_music_path, brain_waves_path)
-
-    return {"status": "success", "output_audio_path": combined_audio_path}
+    return await generate_task_audio(user_id, "release", selected_emotion, selected_tone, min_length, background_options)
 
 @app.post("/generate_sleep_meditation_audio",
         operation_id="generate_sleep_meditation_audio",
@@ -179,7 +250,7 @@ async def generate_release_meditation_audio(user_id: str, selected_emotion: str,
         Args:
             user_id: str
             min_length: int (minimum length of the audio in minutes)
-            background_options: dict (options for background music and brain waves - should have 5 keys. Example:
+            background_options: BackgroundOptions (options for background music and brain waves - all 5 keys are optional. Example:
                 {
                     "should_generate_background_music": True,
                     "music_style": "classical",
@@ -192,30 +263,10 @@ async def generate_release_meditation_audio(user_id: str, selected_emotion: str,
             a dictionary with properties `status`, `output_audio_path`
         ''',
         response_description="a dictionary with properties `status`, `output_audio_path` if successful, or an error message if not")
-async def generate_sleep_meditation_audio(user_id: str, min_length: int, background_options: dict):
+async def generate_sleep_meditation_audio(user_id: str, min_length: int, background_options: BackgroundOptions):
     """Generate a sleep meditation audio."""
-    # Generate the emotional, speaker-cloned audio
-    output_path = generate_meditation_audio(user_id, tts_model, "sleep", None, "calm", min_length, background_options)
-
-    background_music_path = None
-    brain_waves_path = None
-    
-    should_generate_background_music = background_options["should_generate_background_music"]
-    music_style = background_options["music_style"]
-
-    if should_generate_background_music:
-        background_music_path = generate_background_music(user_id, "sleep", music_style)
-
-    should_generate_brain_waves = background_options["should_generate_brain_waves"]
-    if should_generate_brain_waves:
-        brain_waves_type = "theta" #Suitable for sleep
-        volume_magnitude = "low" #Suitable for sleep
-        brain_waves_path = generate_brainwave(user_id, brain_waves_type, volume_magnitude)
-
-    # 6. Combine the emotional, speaker-cloned audio with the background music and brain waves
-    combined_audio_path = combine_audio(output_path, background_music_path, brain_waves_path)
-
-    return {"status": "success", "output_audio_path": combined_audio_path}
+    # Theta waves at low volume are suitable for sleep
+    return await generate_task_audio(user_id, "sleep", None, "calm", min_length, background_options, brain_waves_type="theta", volume_magnitude="low")
 
 @app.post("/generate_mindfulness_meditation_audio",
         operation_id="generate_mindfulness_meditation_audio",
@@ -224,7 +275,7 @@ async def generate_sleep_meditation_audio(user_id: str, min_length: int, backgro
         Args:
             user_id: str
             min_length: int (minimum length of the audio in minutes)
-            background_options: dict (options for background music and brain waves - should have 5 keys. Example:
+            background_options: BackgroundOptions (options for background music and brain waves - all 5 keys are optional. Example:
                 {
                     "should_generate_background_music": True,
                     "music_style": "classical",
@@ -237,30 +288,10 @@ async def generate_sleep_meditation_audio(user_id: str, min_length: int, backgro
             a dictionary with properties `status`, `output_audio_path`
         ''',
         response_description="a dictionary with properties `status`, `output_audio_path` if successful, or an error message if not")
-async def generate_mindfulness_meditation_audio(user_id: str, min_length: int, background_options: dict):
+async def generate_mindfulness_meditation_audio(user_id: str, min_length: int, background_options: BackgroundOptions):
     """Generate a mindfulness meditation audio."""
-    # Generate the emotional, speaker-cloned audio
-    output_path = generate_meditation_audio(user_id, tts_model, "mindfulness", None, "calm", min_length, background_options)
-
-    background_music_path = None
-    brain_waves_path = None
-
-    should_generate_background_music = background_options["should_generate_background_music"]
-    music_style = background_options["music_style"]
-
-    if should_generate_background_music:
-        background_music_path = generate_background_music(user_id, "mindfulness", music_style)
-
-    should_generate_brain_waves = background_options["should_generate_brain_waves"]
-    if should_generate_brain_waves:
-        brain_waves_type = "alpha" #Suitable for mindfulness
-        volume_magnitude = "low" #Suitable for mindfulness
-        brain_waves_path = generate_brainwave(user_id, brain_waves_type, volume_magnitude)
-
-    # 6. Combine the emotional, speaker-cloned audio with the background music and brain waves
-    combined_audio_path = combine_audio(output_path, background_music_path, brain_waves_path)
-
-    return {"status": "success", "output_audio_path": combined_audio_path}
+    # Alpha waves at low volume are suitable for mindfulness
+    return await generate_task_audio(user_id, "mindfulness", None, "calm", min_length, background_options, brain_waves_type="alpha", volume_magnitude="low")
 
 @app.post("/generate_workout_meditation_audio",
         operation_id="generate_workout_meditation_audio",
@@ -270,7 +301,7 @@ async def generate_mindfulness_meditation_audio(user_id: str, min_length: int, b
             user_id: str
             selected_tone: str (user-selected tone for message)
             min_length: int (minimum length of the audio in minutes)
-            background_options: dict (options for background music and brain waves - should have 5 keys. Example:
+            background_options: BackgroundOptions (options for background music and brain waves - all 5 keys are optional. Example:
                 {
                     "should_generate_background_music": True,
                     "music_style": "classical",
@@ -283,28 +314,31 @@ async def generate_mindfulness_meditation_audio(user_id: str, min_length: int, b
             a dictionary with properties `status`, `output_audio_path`
         ''',
         response_description="a dictionary with properties `status`, `output_audio_path` if successful, or an error message if not")
-async def generate_workout_meditation_audio(user_id: str, selected_tone: str, min_length: int, background_options: dict, **kwargs):
+async def generate_workout_meditation_audio(user_id: str, selected_tone: str, min_length: int, background_options: BackgroundOptions, **kwargs):
     """Generate a workout meditation audio."""
-    # Generate the emotional, speaker-cloned audio
-    output_path = generate_meditation_audio(user_id, tts_model, "workout", None, selected_tone, min_length, background_options)
-
-    background_music_path = None
-    brain_waves_path = None
-
-    should_generate_background_music = background_options["should_generate_background_music"]
-    music_style = background_options["music_style"]
-
-    if should_generate_background_music:
-        background_music_path = generate_background_music(user_id, "workout", music_style)
-
-    should_generate_brain_waves = background_options["should_generate_brain_waves"]
-    if should_generate_brain_waves:
-        brain_waves_type = "beta" #Suitable for workout
-        volume_magnitude = background_options["volume_magnitude"] or "high" #Suitable for workout
-        brain_waves_path = generate_brainwave(user_id, brain_waves_type, volume_magnitude)
-
-    # 6. Combine the emotional, speaker-cloned audio with the background music and brain waves
-    combined_audio_path = combine_audio(output_path, background_music_path, brain_waves_path)
-
-    return {"status": "success", "output_audio_path": combined_audio_path}
+    # Workout brain waves are always beta; volume defaults to high
+    volume_magnitude = background_options.volume_magnitude or "high"
+    return await generate_task_audio(user_id, "workout", None, selected_tone, min_length, background_options, brain_waves_type="beta", volume_magnitude=volume_magnitude)
 
+@app.post("/stream_meditation_audio",
+        operation_id="stream_meditation_audio",
+        description='''
+        Stream the voice track of a meditation as Ogg/Opus while it is being synthesized.
+        Args:
+            user_id: str
+            task: str (one of "release", "sleep", "mindfulness", "workout")
+            min_length: int (minimum length of the audio in minutes)
+            selected_emotion: str (user-selected emotion, release only)
+            selected_tone: str (user-selected tone for message, release and workout only)
+        Returns:
+            a chunked audio/ogg stream, one chained Ogg stream per sentence
+        ''',
+        response_description="a chunked audio/ogg stream if successful, or an error message if not")
+async def stream_meditation_audio_endpoint(user_id: str, task: str, min_length: int, selected_emotion: str = None, selected_tone: str = None):
+    """Stream the voice track of a meditation while it is being synthesized."""
+    if task not in ("release", "sleep", "mindfulness", "workout"):
+        raise HTTPException(status_code=400, detail=f"Unknown meditation task: {task}")
+    if task in ("sleep", "mindfulness"):
+        selected_tone = "calm"
+    chunks = await stream_meditation_audio(user_id, get_tts_runner(), task, selected_emotion, selected_tone, min_length)
+    return StreamingResponse(chunks, media_type="audio/ogg")
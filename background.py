@@ -1,124 +1,372 @@
+import contextlib
+import hashlib
+import logging
 import numpy as np
+import os
+import queue
 import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+import soundfile as sf
+import soxr
+import torch
 from user_utils import get_user_tier
-from pydub import AudioSegment
-from audiocraft.models import musicgen
-from audiocraft.data.audio import audio_write
-
-def generate_brainwave(user_id, wave_type, volume_magnitude: str = "low", duration_sec=120, sample_rate=44100):
-    wave_frequencies = {
-        "alpha": 8.0,
-        "beta": 12.0,
-        "delta": 0.5,
-        "theta": 4.0,
-        "gamma": 30.0
-    }
-    volume_magnitudes = {
-        "low": -20,
-        "medium": -10,
-        "high": 0
-    }
-    frequency = wave_frequencies.get(wave_type)
-    volume = volume_magnitudes.get(volume_magnitude)
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["generate_brainwave", "generate_background_music", "combine_audio", "warmup_music_models", "music_batcher", "MUSIC_MAX_BATCH"]
+
+OUTPUT_SAMPLE_RATE = 48000  # Opus only encodes at 8/12/16/24/48 kHz
+
+def generate_brainwave(user_id, wave_type, volume_magnitude: str = "low", duration_sec=120, sample_rate=OUTPUT_SAMPLE_RATE):
+    # generate brain wave tone
+    # return (samples, sample_rate)
+    # Rendered at the mix rate so combine_audio has nothing to resample
     is_premium = get_user_tier(user_id) == "premium"
     if is_premium:
         duration_sec = 600
     else:
         duration_sec = 120
-    t = np.linspace(0, duration_sec, int(sample_rate * duration_sec), endpoint=False)
+    return _render_brainwave(wave_type, volume_magnitude, duration_sec, sample_rate), sample_rate
+
+def _period_samples(frequency, sample_rate, max_periods=100):
+    """Length of the shortest run of whole periods that spans a whole number of samples."""
+    for periods in range(1, max_periods + 1):
+        samples = periods * sample_rate / frequency
+        if samples.is_integer():
+            return int(samples)
+    return None
+
+WAVE_FREQUENCIES = {
+    "alpha": 8.0,
+    "beta": 12.0,
+    "delta": 0.5,
+    "theta": 4.0,
+    "gamma": 30.0
+}
+VOLUME_MAGNITUDES = {
+    "low": -20,
+    "medium": -10,
+    "high": 0
+}
+
+def _render_brainwave(wave_type, volume_magnitude, duration_sec, sample_rate):
+    # The tone is periodic: tile one cached seamless block instead of materializing
+    # a full-length time axis and sine in float64
+    total_samples = int(sample_rate * duration_sec)
+    block = _brainwave_block(wave_type, volume_magnitude, sample_rate)
+    if block is None:
+        return _sine(WAVE_FREQUENCIES[wave_type], VOLUME_MAGNITUDES[volume_magnitude], total_samples, sample_rate)
+    return np.tile(block, -(-total_samples // len(block)))[:total_samples]
+
+# Only the one-block period (at most 2 s of float32) is cached and shared across users;
+# the returned block is read-only.
+@lru_cache(maxsize=32)
+def _brainwave_block(wave_type, volume_magnitude, sample_rate):
+    frequency = WAVE_FREQUENCIES[wave_type]
+    block_samples = _period_samples(frequency, sample_rate)
+    if block_samples is None:
+        return None
+    block = _sine(frequency, VOLUME_MAGNITUDES[volume_magnitude], block_samples, sample_rate)
+    block.setflags(write=False)
+    return block
+
+def _sine(frequency, volume, num_samples, sample_rate):
+    t = np.arange(num_samples, dtype=np.float64) / sample_rate
     wave = np.sin(2 * np.pi * frequency * t)
+    # Apply the dB gain
+    gain = 10 ** (volume / 20.0)
+    return (wave * gain).astype(np.float32)
+
+# MusicGen checkpoints stay resident once loaded; reloading 1.5B/3.3B weights per request
+# dominated latency and could run the GPU out of memory under concurrent requests
+_MODEL_CACHE = {}
+_MODEL_PARAMS = {}
+_MODEL_LOAD_LOCK = threading.Lock()
+# MusicGen is not thread-safe, so requests are generated one at a time on the shared model
+_GENERATE_LOCK = threading.Lock()
+# Own CUDA stream so MusicGen decode can overlap with TTS kernels on the same GPU. Created on
+# first generation (on the batcher thread), not at import, so importing the app creates no CUDA context
+_music_stream = None
+
+MUSIC_MODEL_SIZES = ("medium", "large")
+
+def compile_music_lm(model):
+    """With MUSICGEN_COMPILE=1, compile MusicGen's decoder transformer. audiocraft's
+    streaming transformer already keeps a KV cache and uses PyTorch SDPA, so this removes
+    the remaining per-step eager overhead. The cache grows every step, hence dynamic
+    shapes rather than CUDA graphs."""
+    if os.getenv("MUSICGEN_COMPILE", "0") != "1" or not torch.cuda.is_available():
+        return
+    model.lm.transformer = torch.compile(model.lm.transformer, dynamic=True)
+
+def quantize_music_lm(model, size):
+    """Shrink the decoder weights per MUSICGEN_QUANT; decode is memory-bandwidth-bound,
+    so fewer bytes per weight means faster steps and less VRAM. The EnCodec
+    compression model is left alone.
+
+    On CUDA, "fp16" and "int8" both store the decoder in fp16 for every size
+    (int8 dynamic-quantization kernels are CPU-only).
+    On CPU, "int8" int8-quantizes the free-tier ('medium') decoder's Linear layers and
+    leaves 'large' in fp32; "fp16" changes nothing, since fp16 matmuls are slow on CPU."""
+    quant = os.getenv("MUSICGEN_QUANT", "none").lower()
+    if quant == "int8" and size == "medium" and model.device.type == "cpu":
+        model.lm = torch.ao.quantization.quantize_dynamic(model.lm, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quant in ("fp16", "int8") and model.device.type == "cuda":
+        model.lm = model.lm.half()
+
+def _get_model(size):
+    with _MODEL_LOAD_LOCK:
+        if size not in _MODEL_CACHE:
+            # audiocraft is imported on first use so processes that never generate music skip it
+            from audiocraft.models import musicgen
+            model = musicgen.MusicGen.get_pretrained(size)
+            quantize_music_lm(model, size)
+            compile_music_lm(model)
+            _MODEL_CACHE[size] = model
+        return _MODEL_CACHE[size]
+
+def warmup_music_models():
+    """Load and (when compiled) trace each MusicGen size at startup instead of on the
+    first request; only done with MUSICGEN_COMPILE=1, as it keeps both models resident."""
+    if os.getenv("MUSICGEN_COMPILE", "0") != "1":
+        return
+    for size in MUSIC_MODEL_SIZES:
+        music_batcher.submit(size, 1, "calm ambient meditation instrumental music")
+
+def _set_generation_params(size, model, **params):
+    # Only touch the model when the parameters actually change
+    if _MODEL_PARAMS.get(size) != params:
+        model.set_generation_params(**params)
+        _MODEL_PARAMS[size] = params
+
+MUSIC_BATCH_WINDOW_SEC = 0.1
+MUSIC_MAX_BATCH = 8
+
+class MusicGenBatcher:
+    """Collect prompts from concurrent requests and generate them in one model.generate call.
 
-    # Convert to 16-bit audio
-    audio = np.int16(wave * 32767)
-    segment = AudioSegment(audio.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
-    final_segment = segment + volume
-    final_segment.export(f"brainwave_{user_id}.wav", format="wav")
-    return f"brainwave_{user_id}.wav"
+    Decoding is memory-bandwidth-bound, so a batch of prompts costs little more per step
+    than a single one. Requests are grouped by (model size, duration), which must match
+    within a batch."""
+
+    def __init__(self, max_batch: int = MUSIC_MAX_BATCH, window_sec: float = MUSIC_BATCH_WINDOW_SEC):
+        self.max_batch = max_batch
+        self.window_sec = window_sec
+        self.queue = queue.Queue()
+        self.pending = []  # requests collected but not yet generated, oldest first
+        threading.Thread(target=self._run, daemon=True, name="musicgen-batcher").start()
+
+    def submit(self, size: str, duration_sec: int, prompt: str):
+        """Generate one prompt and return (samples, sample_rate); blocks the calling thread."""
+        future = Future()
+        self.queue.put((size, duration_sec, prompt, future))
+        return future.result()
+
+    def _collect_batch(self):
+        if not self.pending:
+            self.pending.append(self.queue.get())
+        deadline = time.monotonic() + self.window_sec
+        while len(self.pending) < self.max_batch * 2:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self.pending.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        # Serve the oldest request's group first; other groups wait for the next round
+        key = self.pending[0][:2]
+        batch = [request for request in self.pending if request[:2] == key][:self.max_batch]
+        self.pending = [request for request in self.pending if request not in batch]
+        return key, batch
+
+    def _run(self):
+        while True:
+            (size, duration_sec), batch = self._collect_batch()
+            try:
+                results = self._generate(size, duration_sec, [prompt for _, _, prompt, _ in batch])
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, _, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _generate(self, size, duration_sec, prompts):
+        from audiocraft.data.audio_utils import normalize_audio
+        model = _get_model(size)
+        global _music_stream
+        if _music_stream is None and torch.cuda.is_available():
+            _music_stream = torch.cuda.Stream()
+        stream_context = torch.cuda.stream(_music_stream) if _music_stream is not None else contextlib.nullcontext()
+        with _GENERATE_LOCK, stream_context:
+            _set_generation_params(size, model, duration=duration_sec)
+            wav = model.generate(prompts)  # [batch, channels, samples]
+            music = wav.cpu()
+            del wav
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        results = []
+        for item in music:
+            item = normalize_audio(item, strategy="loudness", sample_rate=model.sample_rate)
+            results.append((item[0].numpy(), model.sample_rate))
+        return results
+
+# Global MusicGen batcher instance
+music_batcher = MusicGenBatcher()
+
+_INSTRUMENTS_BY_TASK = {
+    "release": ("soft flutes", "piano", "violin", "cello", "string guitar", "harp"),
+    "sleep": ("piano", "harp"),
+    "workout": ("electric guitar", "drums", "bass", "saxophone", "edm"),
+    "mindfulness": ("soft flutes", "piano", "violin", "cello", "harp"),
+}
 
 def generate_background_music(user_id, task, music_style, duration_sec=120):
     # generate background music
-    # return background music path
+    # return (samples, sample_rate)
     is_premium = get_user_tier(user_id) == "premium"
     if is_premium:
-        model = musicgen.MusicGen.get_pretrained('large')  # use 'small' for faster generation
+        size = 'large'  # use 'small' for faster generation
         duration_sec = 600
     else:
-        model = musicgen.MusicGen.get_pretrained('medium')  # use 'small' for faster generation
+        size = 'medium'  # use 'small' for faster generation
         duration_sec = 120
 
-    model.set_generation_params(duration=duration_sec)  # 60 seconds of music
-
-    if task == "release":
-        instrument_choices = {
-            0: "soft flutes",
-            1: "piano",
-            2: "violin",
-            3: "cello",
-            4: "string guitar",
-            5: "harp"  
-        }
-    elif task == "sleep":
-        instrument_choices = {
-            1: "piano",
-            2: "harp",
-        }
-    elif task == "workout":
-        instrument_choices = {
-            0: "electric guitar",
-            1: "drums",
-            2: "bass",
-            3: "saxophone",
-            4: "edm"
-        }
-    elif task == "mindfulness":
-        instrument_choices = {
-            0: "soft flutes",
-            1: "piano",
-            2: "violin",
-            3: "cello",
-            4: "harp"
-        }
-
-    instruments = []
-    for mix in range(2,4):
-        instrument = instrument_choices.get(random.randint(0, len(instrument_choices) - 1))
-        instruments.append(instrument)
+    instruments = random.sample(_INSTRUMENTS_BY_TASK[task], k=2)
+    # music_style is free client text: collapse whitespace so stray spaces still share cache entries
+    music_style = " ".join(music_style.split())
 
     prompt = f"calm ambient meditation instrumental music with pads and a mix of {', '.join(instruments)} in the style of {music_style}"
-    wav = model.generate([prompt])  # returns list of np arrays
+    cached = _load_cached_music(size, duration_sec, prompt)
+    if cached is not None:
+        return cached
+    samples, sample_rate = music_batcher.submit(size, duration_sec, prompt)
+    _store_cached_music(size, duration_sec, prompt, samples, sample_rate)
+    return samples, sample_rate
+
+# Prompts come from a small space (task x style x instrument pair), so generated tracks
+# are kept on disk keyed by prompt hash and reused instead of re-running MusicGen.
+# Tracks are stored as int16 (a 600 s premium track is ~38 MB) and the directory is
+# capped at MUSIC_CACHE_MAX_BYTES, least recently used entries evicted first.
+MUSIC_CACHE_DIR = os.getenv("MUSIC_CACHE_DIR", "music_cache")
+MUSIC_CACHE_MAX_BYTES = int(os.getenv("MUSIC_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+_music_cache_lock = threading.Lock()
+
+_ensured_dirs = set()
 
-    audio_write(f"background_music_{user_id}", wav[0].cpu(), model.sample_rate, strategy="loudness")
+def _ensure_dir(path):
+    # makedirs once per directory per process rather than on every write
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
 
-    return f"background_music_{user_id}.wav"
+def _music_cache_path(size, duration_sec, prompt):
+    digest = hashlib.blake2b(f"{size}|{duration_sec}|{prompt}".encode(), digest_size=16).hexdigest()
+    return os.path.join(MUSIC_CACHE_DIR, f"{digest}.npz")
 
-def combine_audio(user_id, emotional_audio_path, background_music_path, brain_waves_path):
+def _load_cached_music(size, duration_sec, prompt):
+    path = _music_cache_path(size, duration_sec, prompt)
+    try:
+        with np.load(path) as cached:
+            samples = cached["samples"].astype(np.float32) / 32767.0
+            sample_rate = int(cached["sample_rate"])
+        os.utime(path)  # mark as recently used for eviction
+        return samples, sample_rate
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None
+
+def _store_cached_music(size, duration_sec, prompt, samples, sample_rate):
+    # Best effort: a full disk or eviction error must not fail a request whose music is ready
+    path = _music_cache_path(size, duration_sec, prompt)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    try:
+        _ensure_dir(MUSIC_CACHE_DIR)
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype(np.int16)
+        np.savez(temp_path, samples=pcm, sample_rate=sample_rate)
+        os.replace(temp_path, path)  # atomic, so concurrent readers never see a partial file
+        _evict_cached_music()
+    except OSError as e:
+        logger.warning("Failed to store background music in cache: %s", e)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+def _evict_cached_music():
+    with _music_cache_lock:
+        entries = []
+        for entry in os.scandir(MUSIC_CACHE_DIR):
+            if entry.name.endswith(".npz") and ".tmp." not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= MUSIC_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def _resample(samples, sample_rate, target_rate):
+    if sample_rate == target_rate:
+        return samples
+    return soxr.resample(samples, sample_rate, target_rate).astype(np.float32, copy=False)
+
+FADE_SEC = 6
+# Raised-cosine fade-out curve, computed once at import instead of per layer per request
+_FADE_CURVE = (0.5 * (1.0 + np.cos(np.linspace(0.0, np.pi, FADE_SEC * OUTPUT_SAMPLE_RATE)))).astype(np.float32)
+_FADE_CURVE.setflags(write=False)
+
+def _mix_faded(mix, layer, gain):
+    """Add gain * layer into mix in place, fading out its tail with _FADE_CURVE
+    without materializing a faded copy."""
+    fade_samples = min(len(_FADE_CURVE), len(layer))
+    body = len(layer) - fade_samples
+    if gain == 1.0:
+        mix[:body] += layer[:body]
+    else:
+        mix[:body] += gain * layer[:body]
+    fade = _FADE_CURVE[len(_FADE_CURVE) - fade_samples:]
+    if gain != 1.0:
+        fade = fade * np.float32(gain)
+    mix[body:len(layer)] += layer[body:] * fade
+
+def combine_audio(user_id, emotional_audio, background_music=None, brain_waves=None):
     # combine emotional audio, background music, and brain waves
+    # each part is a (samples, sample_rate) tuple, or None when skipped
     # return combined audio path
-    # Load all components
-    voice = AudioSegment.from_wav(emotional_audio_path)
-    music = AudioSegment.from_wav(background_music_path)
-    brainwave = AudioSegment.from_wav(brain_waves_path)
+    # Mix at the Opus output rate
+    sample_rate = OUTPUT_SAMPLE_RATE
+    voice = _resample(*emotional_audio, sample_rate)
 
     # Settings
-    voice_duration = len(voice)  # in ms
-    fade_duration = 6000         # 6 seconds fade out
-
-    # Trim music and brainwave to voice length + fade
-    max_duration = voice_duration + fade_duration
-    music = music[:max_duration]
-    brainwave = brainwave[:max_duration]
-
-    # Apply fade out to music and brainwave
-    music = music.fade_out(fade_duration)
-    brainwave = brainwave.fade_out(fade_duration)
+    fade_samples = len(_FADE_CURVE)  # 6 seconds fade out
+    brainwave_gain = 10 ** (-10 / 20)  # reduce brainwave volume a bit (-10 dB)
 
-    # Mix music and brainwave first (background)
-    background = music.overlay(brainwave - 10)  # reduce brainwave volume a bit
+    # Trim music and brainwave to voice length + fade (slices are views, not copies)
+    max_samples = len(voice) + fade_samples
+    layers = []
+    if background_music is not None:
+        layers.append((_resample(*background_music, sample_rate)[:max_samples], 1.0))
+    if brain_waves is not None:
+        layers.append((_resample(*brain_waves, sample_rate)[:max_samples], brainwave_gain))
 
-    # Overlay voice at the beginning
-    final_mix = background.overlay(voice, position=0)
+    # Accumulate everything into one preallocated buffer, then clip once in place
+    final_mix = np.zeros(max([len(voice)] + [len(layer) for layer, _ in layers]), dtype=np.float32)
+    final_mix[:len(voice)] += voice
+    for layer, gain in layers:
+        _mix_faded(final_mix, layer, gain)
+    np.clip(final_mix, -1.0, 1.0, out=final_mix)
 
-    # Export final result
-    final_mix.export(f"final_meditation_mix_{user_id}.wav", format="wav")
+    # Export final result as Ogg/Opus (~10x smaller than 16-bit WAV); this is the only disk write in the pipeline
+    output_path = f"final_meditation_mix_{user_id}.ogg"
+    sf.write(output_path, final_mix, sample_rate, format="OGG", subtype="OPUS")
 
-    return f"final_meditation_{user_id}.wav"
+    return output_path
@@ -1,10 +1,38 @@
-import pickle
-from typing import Any
+import struct
+import threading
+import time
+import numpy as np
+
+# Embeddings are stored as a shape header followed by raw fp16 bytes:
+# one byte holding ndim, then ndim little-endian uint32 dimensions.
+EMBEDDING_DTYPE = np.float16
 
 def serialize_embedding(embedding) -> bytes:
     """Serialize numpy array embedding for storage."""
-    return pickle.dumps(embedding)
+    array = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE)
+    return struct.pack(f"<B{array.ndim}I", array.ndim, *array.shape) + array.tobytes()
 
-def deserialize_embedding(data: bytes) -> Any:
+def deserialize_embedding(data: bytes) -> np.ndarray:
     """Deserialize embedding from storage."""
-    return pickle.loads(data) 
\ No newline at end of file
+    ndim = data[0]
+    shape = struct.unpack_from(f"<{ndim}I", data, 1)
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE, offset=1 + 4 * ndim).reshape(shape)
+
+LOG_SAMPLE_INTERVAL_SECONDS = 60
+_last_logged = {}  # message -> (monotonic time of last emit, occurrences suppressed since)
+_log_lock = threading.Lock()
+
+def log_failure(logger, message: str, error: Exception):
+    """Log a backend failure at most once per interval per message, with a count of the
+    repeats that were dropped, so an outage does not flood the log from every request."""
+    now = time.monotonic()
+    with _log_lock:
+        last, suppressed = _last_logged.get(message, (None, 0))
+        if last is not None and now - last < LOG_SAMPLE_INTERVAL_SECONDS:
+            _last_logged[message] = (last, suppressed + 1)
+            return
+        _last_logged[message] = (now, 0)
+    if suppressed:
+        logger.warning("%s: %s (%d similar failures suppressed)", message, error, suppressed)
+    else:
+        logger.warning("%s: %s", message, error)
@@ -1,8 +1,36 @@
-from pymongo import MongoClient
+import logging
+from pymongo import IndexModel, MongoClient, WriteConcern
 import os
-from typing import Optional, Any
-from datetime import datetime, timedelta
-from cache_utils import serialize_embedding, deserialize_embedding
+import threading
+import time
+from typing import Optional, Any, Dict, List
+from datetime import datetime, timezone
+from cache.cache_utils import serialize_embedding, deserialize_embedding, log_failure
+
+logger = logging.getLogger(__name__)
+
+# One pooled client per connection string for the whole process; MongoClient is
+# thread-safe and each instance otherwise opens its own connection pool
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_mongo_client(connection_string: str) -> MongoClient:
+    with _clients_lock:
+        if connection_string not in _clients:
+            _clients[connection_string] = MongoClient(
+                connection_string,
+                maxPoolSize=50,
+                minPoolSize=5,
+                maxIdleTimeMS=300000,
+                waitQueueTimeoutMS=2000,
+                serverSelectionTimeoutMS=2000,  # fail over to the other backend fast instead of after 30 s
+                connectTimeoutMS=2000,
+                socketTimeoutMS=5000,
+                compressors="zlib",  # stdlib-only; zstd/snappy would need extra packages
+                retryWrites=True,
+                w=1,
+            )
+        return _clients[connection_string]
 
 class MongoCache:
     def __init__(self):
@@ -17,19 +45,22 @@ class MongoCache:
             connection_string = os.getenv("MONGO_CONNECTION_STRING", "mongodb://localhost:27017/")
             database_name = os.getenv("MONGO_DATABASE", "meditation_app")
             
-            self.client = MongoClient(connection_string)
+            self.client = get_mongo_client(connection_string)
             db = self.client[database_name]
-            self.collection = db["speaker_embeddings"]
+            # Cached embeddings can be recomputed from the user's voice, so writes skip the journal wait
+            self.collection = db.get_collection("speaker_embeddings", write_concern=WriteConcern(w=1, j=False))
             
             # Test connection and create indexes
             self.client.admin.command('ismaster')
-            self.collection.create_index("user_id", unique=True)
-            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self.collection.create_indexes([
+                IndexModel("user_id", unique=True),
+                IndexModel("expires_at", expireAfterSeconds=0),
+            ])
             
             self.connected = True
-            print("✅ Connected to MongoDB successfully")
+            logger.info("Connected to MongoDB")
         except Exception as e:
-            print(f"❌ Failed to connect to MongoDB: {e}")
+            logger.warning("Failed to connect to MongoDB: %s", e)
             self.connected = False
     
     def is_connected(self) -> bool:
@@ -39,34 +70,51 @@ class MongoCache:
         if not self.is_connected():
             return False
         try:
+            now = time.time()
             document = {
                 "user_id": user_id,
                 "embedding_data": serialize_embedding(embedding),
-                "created_at": datetime.utcnow(),
-                "expires_at": datetime.utcnow() + timedelta(seconds=expiration_seconds)
+                "created_at": datetime.fromtimestamp(now, tz=timezone.utc),
+                # BSON date for the TTL index; integer copy for cheap expiry filters
+                "expires_at": datetime.fromtimestamp(now + expiration_seconds, tz=timezone.utc),
+                "expires_unix": int(now) + expiration_seconds
             }
             self.collection.replace_one({"user_id": user_id}, document, upsert=True)
             return True
         except Exception as e:
-            print(f"MongoDB set failed: {e}")
+            log_failure(logger, "MongoDB set failed", e)
             return False
     
     def get_speaker_embedding(self, user_id: str) -> Optional[Any]:
         if not self.is_connected():
             return None
         try:
-            document = self.collection.find_one({"user_id": user_id})
+            # Expired documents are filtered server-side; the TTL index removes them
+            document = self.collection.find_one(
+                {"user_id": user_id, "expires_unix": {"$gt": int(time.time())}},
+                {"embedding_data": 1, "_id": 0},
+            )
             if document and "embedding_data" in document:
-                # Check if expired
-                if document.get("expires_at") and document["expires_at"] < datetime.utcnow():
-                    self.delete_speaker_embedding(user_id)
-                    return None
                 return deserialize_embedding(document["embedding_data"])
             return None
         except Exception as e:
-            print(f"MongoDB get failed: {e}")
+            log_failure(logger, "MongoDB get failed", e)
             return None
     
+    def get_many_speaker_embeddings(self, user_ids: List[str]) -> Dict[str, Any]:
+        """Fetch several embeddings with one query; missing or expired users are left out."""
+        if not self.is_connected() or not user_ids:
+            return {}
+        try:
+            documents = self.collection.find(
+                {"user_id": {"$in": list(user_ids)}, "expires_unix": {"$gt": int(time.time())}},
+                {"user_id": 1, "embedding_data": 1, "_id": 0},
+            )
+            return {document["user_id"]: deserialize_embedding(document["embedding_data"]) for document in documents}
+        except Exception as e:
+            log_failure(logger, "MongoDB get many failed", e)
+            return {}
+    
     def delete_speaker_embedding(self, user_id: str) -> bool:
         if not self.is_connected():
             return False
@@ -74,21 +122,18 @@ class MongoCache:
             result = self.collection.delete_one({"user_id": user_id})
             return result.deleted_count > 0
         except Exception as e:
-            print(f"MongoDB delete failed: {e}")
+            log_failure(logger, "MongoDB delete failed", e)
             return False
     
     def exists_speaker_embedding(self, user_id: str) -> bool:
         if not self.is_connected():
             return False
         try:
-            document = self.collection.find_one({"user_id": user_id}, {"expires_at": 1})
-            if document:
-                # Check if expired
-                if document.get("expires_at") and document["expires_at"] < datetime.utcnow():
-                    self.delete_speaker_embedding(user_id)
-                    return False
-                return True
-            return False
+            document = self.collection.find_one(
+                {"user_id": user_id, "expires_unix": {"$gt": int(time.time())}},
+                {"_id": 1},
+            )
+            return document is not None
         except Exception:
             return False
     
@@ -97,7 +142,7 @@ class MongoCache:
         if not self.is_connected():
             return 0
         try:
-            result = self.collection.delete_many({"expires_at": {"$lt": datetime.utcnow()}})
+            result = self.collection.delete_many({"expires_at": {"$lt": datetime.now(timezone.utc)}})
             return result.deleted_count
         except Exception:
             return 0 
\ No newline at end of file
@@ -1,7 +1,10 @@
+import logging
 import redis
 import os
-from typing import Optional, Any
-from cache_utils import serialize_embedding, deserialize_embedding
+from typing import Optional, Any, Dict, List
+from cache.cache_utils import serialize_embedding, deserialize_embedding, log_failure
+
+logger = logging.getLogger(__name__)
 
 class RedisCache:
     def __init__(self):
@@ -21,9 +24,9 @@ class RedisCache:
             )
             self.client.ping()
             self.connected = True
-            print("✅ Connected to Redis successfully")
+            logger.info("Connected to Redis")
         except redis.ConnectionError as e:
-            print(f"❌ Failed to connect to Redis: {e}")
+            logger.warning("Failed to connect to Redis: %s", e)
             self.connected = False
     
     def is_connected(self) -> bool:
@@ -36,7 +39,7 @@ class RedisCache:
             data = serialize_embedding(embedding)
             return bool(self.client.setex(f"speaker_embedding:{user_id}", expiration_seconds, data))
         except Exception as e:
-            print(f"Redis set failed: {e}")
+            log_failure(logger, "Redis set failed", e)
             return False
     
     def get_speaker_embedding(self, user_id: str) -> Optional[Any]:
@@ -46,16 +49,27 @@ class RedisCache:
             data = self.client.get(f"speaker_embedding:{user_id}")
             return deserialize_embedding(data) if data else None
         except Exception as e:
-            print(f"Redis get failed: {e}")
+            log_failure(logger, "Redis get failed", e)
             return None
     
+    def get_many_speaker_embeddings(self, user_ids: List[str]) -> Dict[str, Any]:
+        """Fetch several embeddings in one MGET round-trip; missing users are left out."""
+        if not self.is_connected() or not user_ids:
+            return {}
+        try:
+            values = self.client.mget([f"speaker_embedding:{user_id}" for user_id in user_ids])
+            return {user_id: deserialize_embedding(data) for user_id, data in zip(user_ids, values) if data}
+        except Exception as e:
+            log_failure(logger, "Redis mget failed", e)
+            return {}
+    
     def delete_speaker_embedding(self, user_id: str) -> bool:
         if not self.is_connected():
             return False
         try:
             return bool(self.client.delete(f"speaker_embedding:{user_id}"))
         except Exception as e:
-            print(f"Redis delete failed: {e}")
+            log_failure(logger, "Redis delete failed", e)
             return False
     
     def exists_speaker_embedding(self, user_id: str) -> bool:
@@ -1,14 +1,29 @@
+import logging
 import os
-from typing import Optional, Any
+import threading
+from typing import Optional, Any, Dict, List
+from cachetools import TTLCache
 from cache.redis_cache import RedisCache
 from cache.mongo_cache import MongoCache
 from fastapi import HTTPException
 
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_SIZE = 2048
+LOCAL_CACHE_TTL_SECONDS = 60
+LOCAL_EMBEDDING_CACHE_SIZE = 1024
+LOCAL_EMBEDDING_CACHE_TTL_SECONDS = 300
+
 class CacheManager:
     def __init__(self):
         self.cache_backend = os.getenv("CACHE_BACKEND", "redis").lower()
         self.cache = None
         self.fallback_cache = {}  # Simple in-memory fallback
+        # Process-local L1 for existence checks so status polling skips the backend
+        self.local_exists = TTLCache(maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL_SECONDS)
+        # Process-local L1 for embeddings so repeat requests skip the backend round-trip
+        self.local_embeddings = TTLCache(maxsize=LOCAL_EMBEDDING_CACHE_SIZE, ttl=LOCAL_EMBEDDING_CACHE_TTL_SECONDS)
+        self.local_lock = threading.Lock()
         self._initialize_cache()
     
     def _initialize_cache(self):
@@ -24,17 +39,20 @@ class CacheManager:
         self.cache = primary_class()
         
         if not self.cache.is_connected():
-            print(f"⚠️ {self.cache_backend} failed, trying alternative...")
+            logger.warning("%s failed, trying alternative...", self.cache_backend)
             # Try alternative backend
             alternative = MongoCache() if self.cache_backend == "redis" else RedisCache()
             if alternative.is_connected():
                 self.cache = alternative
-                print(f"✅ Using alternative cache: {type(alternative).__name__}")
+                logger.info("Using alternative cache: %s", type(alternative).__name__)
             else:
-                print("❌ All databases failed. Using in-memory cache.")
+                logger.error("All databases failed. Using in-memory cache.")
                 self.cache = None
     
     def set_speaker_embedding(self, user_id: str, embedding, expiration_seconds: int = 2592000) -> bool:
+        with self.local_lock:
+            self.local_exists.pop(user_id, None)
+            self.local_embeddings.pop(user_id, None)
         # Try database cache first
         if self.cache and self.cache.is_connected():
             if self.cache.set_speaker_embedding(user_id, embedding, expiration_seconds):
@@ -45,17 +63,40 @@ class CacheManager:
         return True
     
     def get_speaker_embedding(self, user_id: str) -> Optional[Any]:
+        # Check process-local cache
+        with self.local_lock:
+            embedding = self.local_embeddings.get(user_id)
+        if embedding is not None:
+            return embedding
+
         # Try database cache first
         if self.cache and self.cache.is_connected():
             embedding = self.cache.get_speaker_embedding(user_id)
             if embedding is not None:
+                with self.local_lock:
+                    self.local_embeddings[user_id] = embedding
                 return embedding
         
         # Try fallback cache
         return self.fallback_cache.get(user_id)
     
+    def get_many_speaker_embeddings(self, user_ids: List[str]) -> Dict[str, Any]:
+        """Batch lookup; users without a cached embedding are left out of the result."""
+        embeddings = {}
+        if self.cache and self.cache.is_connected():
+            embeddings = self.cache.get_many_speaker_embeddings(user_ids)
+        
+        # Fill misses from fallback cache
+        for user_id in user_ids:
+            if user_id not in embeddings and user_id in self.fallback_cache:
+                embeddings[user_id] = self.fallback_cache[user_id]
+        return embeddings
+    
     def delete_speaker_embedding(self, user_id: str) -> bool:
         deleted = False
+        with self.local_lock:
+            self.local_exists.pop(user_id, None)
+            self.local_embeddings.pop(user_id, None)
         
         # Delete from database cache
         if self.cache and self.cache.is_connected():
@@ -69,13 +110,18 @@ class CacheManager:
         return deleted
     
     def exists_speaker_embedding(self, user_id: str) -> bool:
-        # Check database cache
-        if self.cache and self.cache.is_connected():
-            if self.cache.exists_speaker_embedding(user_id):
-                return True
-        
-        # Check fallback
-        return user_id in self.fallback_cache
+        # Check process-local cache
+        with self.local_lock:
+            exists = self.local_exists.get(user_id)
+        if exists is not None:
+            return exists
+
+        # Check database cache, then fallback
+        exists = bool(self.cache and self.cache.is_connected() and self.cache.exists_speaker_embedding(user_id))
+        exists = exists or user_id in self.fallback_cache
+        with self.local_lock:
+            self.local_exists[user_id] = exists
+        return exists
     
     def get_cache_info(self) -> dict:
         cache_type = "in-memory"
@@ -104,5 +150,13 @@ class CacheManager:
             )
         return embedding
 
-# Global cache manager instance
-cache_manager = CacheManager() 
\ No newline at end of file
+# Process-wide cache manager, connected on first use rather than at import
+_cache_manager = None
+_cache_manager_lock = threading.Lock()
+
+def get_cache_manager() -> CacheManager:
+    global _cache_manager
+    with _cache_manager_lock:
+        if _cache_manager is None:
+            _cache_manager = CacheManager()
+        return _cache_manager 
\ No newline at end of file
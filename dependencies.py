@@ -0,0 +1,34 @@
+import os
+import threading
+from tts_runner import TTSRunner
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/your_tts"
+
+# Built on first use (from the app's lifespan handler) rather than at import, so each
+# uvicorn worker creates its own CUDA context after it has been forked
+_tts_model = None
+_tts_runner = None
+_lock = threading.Lock()
+
+def get_tts_model():
+    """Return the process-wide TTS model, loading it on first call."""
+    global _tts_model
+    with _lock:
+        if _tts_model is None:
+            if os.getenv("TTS_WORKER_PROCESS", "0") == "1":
+                # Run inference in a dedicated GPU process, away from the HTTP event loop's GIL
+                from tts_worker import TTSWorkerClient
+                _tts_model = TTSWorkerClient(MODEL_NAME)
+            else:
+                from TTS.api import TTS
+                _tts_model = TTS(model_name=MODEL_NAME, progress_bar=False, gpu=True)
+        return _tts_model
+
+def get_tts_runner() -> TTSRunner:
+    """Return the process-wide TTS runner wrapping get_tts_model()."""
+    global _tts_runner
+    tts_model = get_tts_model()
+    with _lock:
+        if _tts_runner is None:
+            _tts_runner = TTSRunner(tts_model)
+        return _tts_runner
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+
+POOL_SLOTS = 1024
+# Slots are reloaded from the cache after this long, so a voice deleted or replaced through
+# another worker stops being used within POOL_TTL_SECONDS plus the cache manager's L1 TTL
+POOL_TTL_SECONDS = 60
+# With a separate TTS worker process the GPU lives there, so keep the pool on the host
+USE_DEVICE = torch.cuda.is_available() and os.getenv("TTS_WORKER_PROCESS", "0") != "1"
+DEVICE = "cuda" if USE_DEVICE else "cpu"
+
+class SpeakerEmbeddingPool:
+    """Keep recently used speaker embeddings in one preallocated device tensor.
+
+    Hot users are served from their slot without a cache round-trip, deserialization
+    or host-to-device copy. Slots are recycled in least-recently-used order and
+    reloaded once older than ttl_seconds."""
+
+    def __init__(self, num_slots: int = POOL_SLOTS, device: str = DEVICE, ttl_seconds: float = POOL_TTL_SECONDS):
+        self.num_slots = num_slots
+        self.device = device
+        self.ttl_seconds = ttl_seconds
+        self.slab = None  # allocated on first insert, once the embedding size is known
+        self.slots = OrderedDict()  # user_id -> (slot, shape, loaded_at), oldest first
+        self.free_slots = list(range(num_slots))
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str, load):
+        """Return the fp32 device embedding for a user, calling load() on a miss."""
+        with self.lock:
+            entry = self.slots.get(user_id)
+            if entry is not None and time.monotonic() - entry[2] < self.ttl_seconds:
+                self.slots.move_to_end(user_id)
+                return self._read(entry[0], entry[1])
+
+        # Load outside the lock so a slow cache backend does not block hot users
+        embedding = np.asarray(load(), dtype=np.float32)
+        with self.lock:
+            if self.slab is None:
+                self.slab = torch.empty((self.num_slots, embedding.size), dtype=torch.float32, device=self.device)
+            if embedding.size != self.slab.shape[1]:
+                return torch.from_numpy(embedding).to(self.device)
+            if user_id in self.slots:
+                slot = self.slots.pop(user_id)[0]  # expired entry: reload into the same slot
+            elif self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = self.slots.popitem(last=False)[1][0]
+            self.slab[slot].copy_(torch.from_numpy(embedding.reshape(-1)))
+            self.slots[user_id] = (slot, embedding.shape, time.monotonic())
+            return self._read(slot, embedding.shape)
+
+    def _read(self, slot: int, shape):
+        # Clone (device-side, ~2 KB) so a queued request keeps its voice if the slot is recycled
+        return self.slab[slot].view(shape).clone()
+
+    def evict(self, user_id: str):
+        """Drop a user's slot, e.g. after their embedding is re-cached or cleared."""
+        with self.lock:
+            entry = self.slots.pop(user_id, None)
+            if entry is not None:
+                self.free_slots.append(entry[0])
+
+# Global speaker embedding pool instance
+speaker_embedding_pool = SpeakerEmbeddingPool()
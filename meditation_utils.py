@@ -1,8 +1,14 @@
+import asyncio
+import io
+import re
+import threading
 import numpy as np
+import soundfile as sf
+from cachetools import TTLCache
 from huggingface_hub import InferenceClient
-from pymongo import MongoClient
-from cache_manager import cache_manager
-from user_utils import get_user_tier
+from cache_manager import get_cache_manager
+from embedding_pool import speaker_embedding_pool
+from user_utils import get_db, get_user_tier
 
 with open("prompts/release_prompt_template.txt", "r") as file:
     release_prompt_template = file.read()
@@ -13,36 +19,59 @@ with open("prompts/workout_prompt_template.txt", "r") as file:
 with open("prompts/mindfulness_prompt_template.txt", "r") as file:
     mindfulness_prompt_template = file.read()
 
+EMOTION_EMBEDDING_NAMES = ("happy", "sad", "angry", "calm")
+emotion_embeddings = {}
+
+def preload_emotion_embeddings():
+    """Memory-map every emotion embedding once (called at startup)."""
+    for emotion in EMOTION_EMBEDDING_NAMES:
+        emotion_embeddings[emotion] = np.load(f"emotion_embeddings/{emotion}.npy", mmap_mode="r")
+    return emotion_embeddings
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
 def get_user_emotion_embedding(emotion):
     # get user's selected emotion embedding from emotion_embeddings folder
     # return emotion embedding
-    emotion_embeddings = {
-    "happy": np.load("emotion_embeddings/happy.npy"),
-    "sad": np.load("emotion_embeddings/sad.npy"),
-    "angry": np.load("emotion_embeddings/angry.npy"),
-    "calm": np.load("emotion_embeddings/calm.npy"),
-    }
+    if not emotion_embeddings:
+        preload_emotion_embeddings()
     emotion_embedding = emotion_embeddings[emotion]
     return emotion_embedding
 
+# Inputs are few (task x emotion x tone x length x tier), so texts are reused across requests
+# for an hour; edits to the default texts show up once their entry expires
+meditation_text_cache = TTLCache(maxsize=4096, ttl=3600)
+meditation_text_lock = threading.Lock()
+
 def get_meditation_text(task, emotion, tone, min_length, is_premium=True):
     # get meditation text from meditation_texts folder
     # return meditation text
+    key = (task, emotion, tone, min_length, is_premium)
+    with meditation_text_lock:
+        text = meditation_text_cache.get(key)
+    if text is not None:
+        return text
+
     if is_premium:
-        return get_ai_meditation_text(emotion, tone, task, min_length)
+        text = get_ai_meditation_text(emotion, tone, task, min_length)
     else:
-        return get_default_meditation_text(emotion, tone, task)
+        text = get_default_meditation_text(emotion, tone, task)
+    # Empty or missing texts are not cached, so a failed lookup is retried on the next request
+    if text:
+        with meditation_text_lock:
+            meditation_text_cache[key] = text
+    return text
 
 def get_default_meditation_text(emotion, tone, task: str):
     # get from database the default meditation text for the emotion
     if task == "release":
-        text = MongoClient.db.release_meditation_texts.find_one({"emotion": emotion, "tone": tone})
+        text = get_db().release_meditation_texts.find_one({"emotion": emotion, "tone": tone})
     elif task == "sleep":
-        text = MongoClient.db.sleep_meditation_texts.find_one({"emotion": emotion, "tone": tone})
+        text = get_db().sleep_meditation_texts.find_one({"emotion": emotion, "tone": tone})
     elif task == "workout":
-        text = MongoClient.db.workout_meditation_texts.find_one({"emotion": emotion, "tone": tone})
+        text = get_db().workout_meditation_texts.find_one({"emotion": emotion, "tone": tone})
     elif task == "mindfulness":
-        text = MongoClient.db.mindfulness_meditation_texts.find_one({"emotion": emotion, "tone": tone})
+        text = get_db().mindfulness_meditation_texts.find_one({"emotion": emotion, "tone": tone})
     else:
         text = None
     # return default meditation text
@@ -100,12 +129,11 @@ def get_ai_meditation_text(emotion, tone, task: str, min_length: int, **kwargs):
     else:
         return None
 
-def generate_meditation_audio(user_id: str, tts_model, task: str, selected_emotion: str, selected_tone: str, min_length: int, background_options: dict):
-    # 1. Get cached speaker embedding
-    speaker_embedding = cache_manager.get_cached_speaker_embedding(user_id)
+def prepare_meditation_inputs(user_id: str, task: str, selected_emotion: str, selected_tone: str, min_length: int):
+    # return (text, speaker_embedding, emotion_embedding) for a meditation request
+    # 1. Get cached speaker embedding (stored as fp16, served as fp32 from the device pool)
+    speaker_embedding = speaker_embedding_pool.get(user_id, lambda: get_cache_manager().get_cached_speaker_embedding(user_id))
 
-    # 2. Load pre-defined emotion embedding (these should be precomputed & saved as .npy files)
-    emotion_embedding = get_user_emotion_embedding(selected_tone)
     is_premium = get_user_tier(user_id) == "premium"
     if task == "release":
         if selected_tone in [None, "None", "none"]:
@@ -120,16 +148,43 @@ def generate_meditation_audio(user_id: str, tts_model, task: str, selected_emoti
             selected_tone = "energetic"
         text = get_meditation_text("workout", selected_emotion, selected_tone, min_length, is_premium)
 
+    # 2. Load pre-defined emotion embedding (these should be precomputed & saved as .npy files)
     emotion_embedding = get_user_emotion_embedding(selected_tone)
-    
-    # 4. Generate the emotional, speaker-cloned audio
-    output_path = f"output_{task}_meditation_{user_id}.wav"
-    tts_model.tts_to_file(
-        text=text,
-        speaker_embedding=speaker_embedding,
-        style_wav=None,  # Optional: could be an emotional style reference instead of embedding
-        emotion_embedding=emotion_embedding,  # Only works if the model supports it
-        file_path=output_path
-    )
-
-    return output_path
\ No newline at end of file
+    return text, speaker_embedding, emotion_embedding
+
+async def generate_meditation_audio(tts_runner, text: str, speaker_embedding, emotion_embedding):
+    # Inputs come from prepare_meditation_inputs, which callers run off the event loop first
+    # so a missing embedding fails before any other audio work is started
+    # 4. Generate the emotional, speaker-cloned audio (kept in memory for mixing)
+    wav = await tts_runner.submit(text, speaker_embedding, emotion_embedding)
+    sample_rate = tts_runner.sample_rate
+
+    return np.asarray(wav, dtype=np.float32), sample_rate
+
+def split_sentences(text: str) -> list:
+    return [sentence for sentence in SENTENCE_BOUNDARY.split(text.strip()) if sentence]
+
+def encode_opus_chunk(samples, sample_rate) -> bytes:
+    """Encode one chunk of audio as a self-contained Ogg/Opus stream."""
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+    return buffer.getvalue()
+
+async def stream_meditation_audio(user_id: str, tts_runner, task: str, selected_emotion: str, selected_tone: str, min_length: int):
+    # Resolve inputs up front so cache misses surface as HTTP errors before streaming starts
+    text, speaker_embedding, emotion_embedding = await asyncio.to_thread(prepare_meditation_inputs, user_id, task, selected_emotion, selected_tone, min_length)
+    sample_rate = tts_runner.sample_rate
+
+    async def chunks():
+        # Synthesize sentence by sentence, keeping the next sentence in flight while
+        # the current one is encoded and sent. Each chunk is a chained Ogg stream.
+        pending = None
+        for sentence in split_sentences(text):
+            upcoming = asyncio.ensure_future(tts_runner.submit(sentence, speaker_embedding, emotion_embedding))
+            if pending is not None:
+                yield await asyncio.to_thread(encode_opus_chunk, np.asarray(await pending, dtype=np.float32), sample_rate)
+            pending = upcoming
+        if pending is not None:
+            yield await asyncio.to_thread(encode_opus_chunk, np.asarray(await pending, dtype=np.float32), sample_rate)
+
+    return chunks()
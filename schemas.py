@@ -0,0 +1,15 @@
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+# Literal fields are checked by pydantic-core at parse time, and unknown wave types
+# or volumes are rejected with a 422 instead of failing later inside audio generation
+BrainWaveType = Literal["alpha", "beta", "delta", "theta", "gamma"]
+VolumeMagnitude = Literal["low", "medium", "high"]
+
+class BackgroundOptions(BaseModel):
+    """Options for background music and brain waves, validated once at request parse time."""
+    should_generate_background_music: bool = False
+    music_style: str = Field("classical", max_length=64)  # longer styles get a 422 rather than being cut
+    should_generate_brain_waves: bool = False
+    brain_waves_type: BrainWaveType = "theta"
+    volume_magnitude: Optional[VolumeMagnitude] = None  # None uses the task default (low, or high for workout)
@@ -0,0 +1,25 @@
+import torch
+import torchaudio
+
+def compute_speaker_embedding(tts_model, voice_path):
+    """Extract a speaker embedding with audio decoding on torchaudio and resampling
+    and spectrogram work on the encoder's device instead of librosa/NumPy on the CPU."""
+    if not hasattr(tts_model, "synthesizer"):
+        return tts_model.get_speaker_embedding(voice_path)  # TTSWorkerClient does this in its process
+
+    speaker_manager = tts_model.synthesizer.tts_model.speaker_manager
+    encoder = getattr(speaker_manager, "encoder", None)
+    encoder_config = getattr(speaker_manager, "encoder_config", None)
+    # Encoders without an in-model torch spectrogram expect Coqui's own CPU mel features
+    if encoder is None or not encoder_config.model_params.get("use_torch_spec", False):
+        return tts_model.get_speaker_embedding(voice_path)
+
+    device = next(encoder.parameters()).device
+    wav, sample_rate = torchaudio.load(voice_path)
+    wav = wav.mean(dim=0, keepdim=True).to(device, non_blocking=True)  # mono, [1, T]
+    target_rate = encoder_config.audio["sample_rate"]
+    with torch.inference_mode():
+        if sample_rate != target_rate:
+            wav = torchaudio.functional.resample(wav, sample_rate, target_rate)
+        # The encoder computes its (cuFFT-backed) spectrogram from the raw waveform
+        return encoder.compute_embedding(wav)
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+import os
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+SPEAKER_EMBEDDING_DIM = 512  # YourTTS d-vector size
+
+def use_bf16() -> bool:
+    """bf16 autocast is used unless TTS_PRECISION=fp32 or the GPU lacks bf16 support."""
+    precision = os.getenv("TTS_PRECISION", "bf16").lower()
+    return precision == "bf16" and torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+
+def compile_decoder(tts_model):
+    """With TTS_COMPILE=1, compile the VITS waveform decoder with torch.compile's default
+    mode to fuse its kernels. Sentence lengths vary freely, so the decoder is compiled
+    with dynamic shapes rather than CUDA graphs, which would capture a new graph per length."""
+    if os.getenv("TTS_COMPILE", "0") != "1" or not torch.cuda.is_available():
+        return
+    vits = tts_model.synthesizer.tts_model
+    vits.waveform_decoder = torch.compile(vits.waveform_decoder, dynamic=True, fullgraph=False)
+
+class TTSRunner:
+    """Run TTS requests one at a time on a dedicated inference thread.
+
+    YourTTS has no batched forward, so each request is its own executor call and
+    resolves as soon as its own synthesis finishes."""
+
+    def __init__(self, tts_model):
+        self.tts_model = tts_model
+        if hasattr(tts_model, "synthesizer"):
+            tts_model.synthesizer.tts_model.eval()
+            compile_decoder(tts_model)
+            self.sample_rate = tts_model.synthesizer.output_sample_rate
+        else:
+            self.sample_rate = tts_model.sample_rate  # TTSWorkerClient
+        self.use_bf16 = use_bf16()
+        # A dedicated CUDA stream lets TTS kernels overlap with MusicGen's on the same GPU
+        self.stream = torch.cuda.Stream() if torch.cuda.is_available() and hasattr(tts_model, "synthesizer") else None
+        # A single inference thread keeps the GPU busy without threads contending for it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts_runner")
+
+    async def warmup(self):
+        """Run one dummy synthesis on the inference thread so CUDA init, kernel selection
+        and decoder compilation happen at startup instead of on live requests."""
+        speaker_embedding = torch.zeros(1, SPEAKER_EMBEDDING_DIM)
+        await self.submit("Breathe in slowly. Breathe out slowly.", speaker_embedding, None)
+
+    async def submit(self, text: str, speaker_embedding, emotion_embedding):
+        """Synthesize one text on the inference thread and return its waveform."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._synthesize, text, speaker_embedding, emotion_embedding)
+
+    def _synthesize(self, text, speaker_embedding, emotion_embedding):
+        if self.stream is not None:
+            self.stream.wait_stream(torch.cuda.current_stream())  # pooled speaker embeddings are copied on the default stream
+        stream_context = torch.cuda.stream(self.stream) if self.stream is not None else contextlib.nullcontext()
+        with stream_context, torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16, enabled=self.use_bf16):
+            return self.tts_model.tts(
+                text=text,
+                speaker_embedding=speaker_embedding,
+                style_wav=None,  # Optional: could be an emotional style reference instead of embedding
+                emotion_embedding=emotion_embedding,  # Only works if the model supports it
+            )
@@ -0,0 +1,124 @@
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+
+def _to_shared_memory(array: np.ndarray) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block
+
+def _from_shared_memory(name: str, shape) -> np.ndarray:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.float32, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+def run_worker(model_name: str, jobs, results):
+    """GPU process loop: owns the TTS model and answers jobs through shared memory."""
+    from TTS.api import TTS
+    from speaker_utils import compute_speaker_embedding
+    from tts_runner import compile_decoder, use_bf16
+
+    tts_model = TTS(model_name=model_name, progress_bar=False, gpu=True)
+    tts_model.synthesizer.tts_model.eval()
+    compile_decoder(tts_model)
+    bf16 = use_bf16()
+    results.put(tts_model.synthesizer.output_sample_rate)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, kind, args = job
+        try:
+            with torch.inference_mode(), torch.autocast("cuda", dtype=torch.bfloat16, enabled=bf16 and kind == "tts"):
+                if kind == "tts":
+                    text, speaker_embedding, emotion_embedding = args
+                    output = tts_model.tts(
+                        text=text,
+                        speaker_embedding=torch.from_numpy(speaker_embedding).to("cuda"),
+                        style_wav=None,
+                        emotion_embedding=emotion_embedding,
+                    )
+                else:
+                    output = compute_speaker_embedding(tts_model, *args)
+            array = torch.as_tensor(output).float().cpu().numpy()
+            block = _to_shared_memory(array)
+            results.put((job_id, block.name, array.shape, None))
+            block.close()
+        except Exception as e:
+            results.put((job_id, None, None, repr(e)))
+
+class TTSWorkerClient:
+    """Drop-in for the TTS model that runs inference in a dedicated GPU process.
+
+    Keeps PyTorch's Python-side work off the HTTP process's GIL. Jobs go over a
+    multiprocessing queue; waveforms come back through shared memory blocks."""
+
+    POLL_SECONDS = 1.0  # how often blocked reads check that the worker is still alive
+
+    def __init__(self, model_name: str):
+        context = mp.get_context("spawn")  # CUDA cannot be initialized in a forked child
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=run_worker, args=(model_name, self.jobs, self.results), daemon=True)
+        self.process.start()
+        self.sample_rate = self._get_result()  # sent once the model is loaded
+        self._job_ids = itertools.count()
+        self._pending = {}
+        self._dead = None  # set to an exception once the worker has exited
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read_results, daemon=True).start()
+
+    def _get_result(self):
+        # Poll so a worker that crashed (failed model load, OOM, segfault) raises instead of blocking forever
+        while True:
+            try:
+                return self.results.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"TTS worker exited with code {self.process.exitcode}")
+
+    def _read_results(self):
+        while True:
+            try:
+                job_id, name, shape, error = self._get_result()
+            except RuntimeError as e:
+                with self._lock:
+                    self._dead = e
+                    pending, self._pending = self._pending, {}
+                for future in pending.values():
+                    future.set_exception(e)
+                return
+            with self._lock:
+                future = self._pending.pop(job_id)
+            if error is not None:
+                future.set_exception(RuntimeError(f"TTS worker failed: {error}"))
+            else:
+                future.set_result(_from_shared_memory(name, shape))
+
+    def _submit(self, kind: str, args) -> np.ndarray:
+        future = Future()
+        with self._lock:
+            if self._dead is not None:
+                raise self._dead
+            job_id = next(self._job_ids)
+            self._pending[job_id] = future
+        self.jobs.put((job_id, kind, args))
+        return future.result()
+
+    def tts(self, text, speaker_embedding, emotion_embedding=None, **kwargs):
+        speaker_embedding = torch.as_tensor(speaker_embedding).float().cpu().numpy()
+        if emotion_embedding is not None:
+            emotion_embedding = np.asarray(emotion_embedding)
+        return self._submit("tts", (text, speaker_embedding, emotion_embedding))
+
+    def get_speaker_embedding(self, voice_path):
+        return self._submit("speaker_embedding", (voice_path,))
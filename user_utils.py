@@ -1,21 +1,42 @@
-from pymongo import MongoClient
+import os
+import threading
+from cachetools import TTLCache, cached
+from cache.mongo_cache import get_mongo_client
 
+# Connected on first use rather than at import
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Return the application database, connecting on first call."""
+    global _db
+    with _db_lock:
+        if _db is None:
+            # Shares the cache's tuned, pooled client when both point at the same server
+            client = get_mongo_client(os.getenv("MONGO_CONNECTION_STRING", "mongodb://localhost:27017/"))
+            _db = client[os.getenv("MONGO_DATABASE", "meditation_app")]
+        return _db
+
+# Tiers change rarely but are read several times per meditation request
+user_tier_cache = TTLCache(maxsize=10000, ttl=60)
+
+@cached(user_tier_cache, lock=threading.Lock())
 def get_user_tier(user_id):
     # get user tier from database
-    db = MongoClient.db
-    user = db.users.find_one({"user_id": user_id})
+    db = get_db()
+    user = db.users.find_one({"user_id": user_id}, {"tier": 1, "_id": 0})
     return user["tier"]
 
 def get_user_subscription_status(user_id):
     # get user subscription status from database
-    db = MongoClient.db
-    user = db.users.find_one({"user_id": user_id})
+    db = get_db()
+    user = db.users.find_one({"user_id": user_id}, {"subscription_status": 1, "_id": 0})
     return user["subscription_status"]
 
 def get_user_voice_path(user_id):
     # Get user voice from database
     # Return file path
-    db = MongoClient.db
-    user = db.users.find_one({"user_id": user_id})
+    db = get_db()
+    user = db.users.find_one({"user_id": user_id}, {"voice_path": 1, "_id": 0})
     voice_path = user["voice_path"]
     return voice_path